@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
@@ -15,9 +16,84 @@ This analysis shows TPS and pod counts for each service during Ramadan 2024, wit
 Use the sidebar controls to customize the visualization.
 """)
 
-# Load the data
-df = pd.read_csv('ramadan_hourly.csv')
-df['hour'] = pd.to_datetime(df['hour'])
+# Generated from ramadan_hourly.csv by convert.py
+DATA_PATH = 'ramadan_hourly.parquet'
+
+# Per-selection caches are shared by all sessions, so bound how many results each keeps
+CACHE_MAX_ENTRIES = 32
+
+# Above this many services, the chart draws one combined trace per metric
+MAX_SERVICE_TRACES = 10
+
+# Pandas aggregation and resampling frequency for each sidebar option
+AGG_MAP = {
+    "Maximum": "max",
+    "Average": "mean",
+    "Minimum": "min"
+}
+FREQ_MAP = {
+    "Hour": "H",
+    "Day": "D",
+    "Week": "W"
+}
+
+# Statistics table columns for each metric
+TPS_STAT_COLS = ("Peak TPS", "Peak TPS Time", "Avg TPS")
+POD_STAT_COLS = ("Peak Pods", "Peak Pods Time", "Avg Pods")
+
+# Load the data once and reuse it across reruns
+@st.cache_data
+def load_data(path):
+    df = pd.read_parquet(path)
+    # The Hour window uses rows as-is, so each service can have only one row per hour
+    if df.duplicated(['hour', 'service']).any():
+        raise ValueError(f"{path} has more than one row for some service and hour")
+    # Keep rows in time order so date ranges can be sliced with searchsorted, with services
+    # ordered within each hour so groupby output is already in key order without re-sorting
+    df = df.sort_values(['hour', 'service'], kind='stable').reset_index(drop=True)
+    # Categories are already sorted, so this is the sidebar's service list
+    all_services = df['service'].cat.categories.tolist()
+    return df, all_services
+
+# Filter and aggregate once per date range, time window, method and service selection
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def aggregate_data(path, start_date, end_date, time_window, agg_method, services):
+    df, _ = load_data(path)
+    agg_method_str = AGG_MAP[agg_method]
+
+    # Filter by date range
+    lo = df['hour'].searchsorted(start_date, side='left')
+    hi = df['hour'].searchsorted(end_date, side='right')
+    df_filtered = df.iloc[lo:hi]
+
+    # Filter by selected services, comparing category codes rather than service names
+    selected_codes = df['service'].cat.categories.get_indexer(services)
+    selected_codes = selected_codes[selected_codes >= 0]
+    df_filtered = df_filtered[np.isin(df_filtered['service'].cat.codes.to_numpy(), selected_codes)]
+
+    if time_window == "Hour":
+        # There is one row per service and hour (enforced by load_data), so every aggregation
+        # method would return the rows unchanged; they are already in (hour, service) order
+        df_agg = df_filtered[['hour', 'service', 'tps', 'pods']].rename(columns={'hour': 'group'})
+        df_agg = df_agg.reset_index(drop=True)
+    else:
+        # Aggregate by selected time window, labelling each bucket by its start
+        time_grouper = pd.Grouper(key='hour', freq=FREQ_MAP[time_window], closed='left', label='left')
+
+        df_agg = df_filtered.groupby([time_grouper, 'service'], sort=False, observed=True).agg({
+            'tps': agg_method_str,
+            'pods': agg_method_str
+        }).reset_index().rename(columns={'hour': 'group'})
+
+    # Keep only the selected services as categories so later groupbys never see unused levels
+    df_agg['service'] = df_agg['service'].cat.remove_unused_categories()
+
+    # Widen to the shortest float64 that round-trips each float32 value, so the chart JSON
+    # carries 242.8 rather than 242.8000030517578; no value changes beyond float32 precision
+    df_agg[['tps', 'pods']] = df_agg[['tps', 'pods']].astype(str).astype('float64')
+    return df_agg
+
+df, all_services = load_data(DATA_PATH)
 
 # Get time range
 min_date = df['hour'].min()
@@ -40,7 +116,7 @@ with st.sidebar:
     st.subheader("Time Aggregation")
     time_window = st.selectbox(
         "Group Data By",
-        ["Hour", "Day", "Week"],
+        list(FREQ_MAP),
         index=0
     )
     
@@ -48,7 +124,7 @@ with st.sidebar:
     st.subheader("Aggregation Method")
     agg_method = st.selectbox(
         "Calculate",
-        ["Maximum", "Average", "Minimum"],
+        list(AGG_MAP),
         index=0
     )
     
@@ -68,154 +144,170 @@ with st.sidebar:
     )
     
     if view_mode == "Select Services":
-        services = sorted(df['service'].unique())
         selected_services = st.multiselect(
             "Select Services",
-            services,
-            default=services
+            all_services,
+            default=all_services
         )
     else:
-        selected_services = sorted(df['service'].unique())
+        selected_services = all_services
 
 # Filter by date range
 start_date = pd.Timestamp(date_range[0])
 end_date = pd.Timestamp(date_range[1]) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
-df_filtered = df[(df['hour'] >= start_date) & (df['hour'] <= end_date)]
 
-# Filter by selected services
-df_filtered = df_filtered[df_filtered['service'].isin(selected_services)]
+agg_key = (DATA_PATH, start_date, end_date, time_window, agg_method, tuple(selected_services))
+df_agg = aggregate_data(*agg_key)
 
-# Aggregate by selected time window
-if time_window == "Day":
-    df_filtered['group'] = df_filtered['hour'].dt.floor('D')
-elif time_window == "Week":
-    df_filtered['group'] = df_filtered['hour'].dt.floor('W')
-else:
-    df_filtered['group'] = df_filtered['hour']
+# Split the aggregated data by service once, in selection order
+groups = dict(list(df_agg.groupby('service', sort=False, observed=True)))
+service_frames = {service: groups[service] for service in selected_services if service in groups}
 
-# Apply selected aggregation method
-agg_map = {
-    "Maximum": "max",
-    "Average": "mean",
-    "Minimum": "min"
-}
-agg_method_str = agg_map[agg_method]
+# Build the chart once per aggregation and metric selection; the figure is reused as-is across reruns
+@st.cache_resource(max_entries=CACHE_MAX_ENTRIES)
+def build_figure(agg_key, show_metrics, _df_agg, _service_frames):
+    df_agg, service_frames = _df_agg, _service_frames
+    time_window, agg_method = agg_key[3], agg_key[4]
 
-df_agg = df_filtered.groupby(['group', 'service']).agg({
-    'tps': agg_method_str,
-    'pods': agg_method_str
-}).reset_index()
+    # Create figure with secondary y-axis if needed; a single metric gets a plain figure
+    use_secondary_y = len(show_metrics) > 1
+    if use_secondary_y:
+        fig = make_subplots(specs=[[{"secondary_y": True}]])
+        tps_axis, pods_axis = {"secondary_y": False}, {"secondary_y": True}
+    else:
+        fig = go.Figure()
+        tps_axis, pods_axis = {}, {}
 
-# Create figure with secondary y-axis if needed
-use_secondary_y = len(show_metrics) > 1
-fig = make_subplots(specs=[[{"secondary_y": use_secondary_y}]])
+    combine_services = len(service_frames) > MAX_SERVICE_TRACES
+    if combine_services:
+        # Too many services for a trace each: draw one line per metric, with a gap between services
+        gaps = df_agg.groupby('service', sort=False, observed=True).tail(1).assign(tps=np.nan, pods=np.nan)
+        combined = pd.concat([df_agg, gaps]).sort_values(['service', 'group'], kind='stable')
 
-# Add traces for each service
-for service in selected_services:
-    service_data = df_agg[df_agg['service'] == service]
-    
-    # Add TPS line if selected
-    if "TPS" in show_metrics:
-        fig.add_trace(
-            go.Scatter(
-                x=service_data['group'],
-                y=service_data['tps'],
-                name=f"{service} (TPS)",
-                line=dict(width=2),
-            ),
-            secondary_y=False,
-        )
-    
-    # Add Pods line if selected
-    if "Pods" in show_metrics:
-        fig.add_trace(
-            go.Scatter(
-                x=service_data['group'],
-                y=service_data['pods'],
-                name=f"{service} (Pods)",
-                line=dict(dash='dot', width=2),
-            ),
-            secondary_y=use_secondary_y,  # Only use secondary y if showing both metrics
-        )
+        # Add TPS line if selected
+        if "TPS" in show_metrics:
+            fig.add_trace(
+                go.Scattergl(
+                    x=combined['group'],
+                    y=combined['tps'],
+                    customdata=combined['service'],
+                    name="TPS",
+                    hovertemplate="%{customdata}: %{y}<extra>TPS</extra>",
+                    line=dict(width=2),
+                ),
+                **tps_axis,
+            )
+
+        # Add Pods line if selected
+        if "Pods" in show_metrics:
+            fig.add_trace(
+                go.Scattergl(
+                    x=combined['group'],
+                    y=combined['pods'],
+                    customdata=combined['service'],
+                    name="Pods",
+                    hovertemplate="%{customdata}: %{y}<extra>Pods</extra>",
+                    line=dict(dash='dot', width=2),
+                ),
+                **pods_axis,  # Only use secondary y if showing both metrics
+            )
+    else:
+        # Add traces for each service
+        for service, service_data in service_frames.items():
+            # Add TPS line if selected
+            if "TPS" in show_metrics:
+                fig.add_trace(
+                    go.Scattergl(
+                        x=service_data['group'],
+                        y=service_data['tps'],
+                        name=f"{service} (TPS)",
+                        line=dict(width=2),
+                    ),
+                    **tps_axis,
+                )
+        
+            # Add Pods line if selected
+            if "Pods" in show_metrics:
+                fig.add_trace(
+                    go.Scattergl(
+                        x=service_data['group'],
+                        y=service_data['pods'],
+                        name=f"{service} (Pods)",
+                        line=dict(dash='dot', width=2),
+                    ),
+                    **pods_axis,  # Only use secondary y if showing both metrics
+                )
 
-# Update layout
-metrics_shown = " and ".join(show_metrics)
-fig.update_layout(
-    title=f"{agg_method} {metrics_shown} by {time_window}",
-    height=700,
-    hovermode="x unified",
-    showlegend=True,
-    legend=dict(
-        yanchor="top",
-        y=0.99,
-        xanchor="left",
-        x=1.02
+    # Update layout
+    metrics_shown = " and ".join(show_metrics)
+    fig.update_layout(
+        title=f"{agg_method} {metrics_shown} by {time_window}",
+        height=700,
+        # A combined trace has a point for every service at each x, so unified hover would show
+        # an arbitrary one; hover the point under the cursor instead
+        hovermode="closest" if combine_services else "x unified",
+        showlegend=True,
+        legend=dict(
+            yanchor="top",
+            y=0.99,
+            xanchor="left",
+            x=1.02
+        )
     )
-)
 
-# Set y-axes titles
-if "TPS" in show_metrics:
-    fig.update_yaxes(title_text="Transactions Per Second", secondary_y=False)
-if "Pods" in show_metrics:
-    y_axis = use_secondary_y if "TPS" in show_metrics else False
-    fig.update_yaxes(title_text="Number of Pods", secondary_y=y_axis)
-fig.update_xaxes(title_text="Time")
+    # Set y-axes titles
+    if "TPS" in show_metrics:
+        fig.update_yaxes(title_text="Transactions Per Second", **tps_axis)
+    if "Pods" in show_metrics:
+        fig.update_yaxes(title_text="Number of Pods", **pods_axis)
+    fig.update_xaxes(title_text="Time")
+
+    return fig
 
 # Show the figure
+fig = build_figure(agg_key, tuple(show_metrics), df_agg, service_frames)
 st.plotly_chart(fig, use_container_width=True)
 
 # Calculate statistics using the filtered and aggregated data
-stats = []
-for service in selected_services:
-    service_data = df_agg[df_agg['service'] == service]
-    stat_row = {"Service": service}
-    
-    if "TPS" in show_metrics:
-        peak_tps = service_data['tps'].max()
-        peak_tps_idx = service_data['tps'].idxmax()
-        peak_tps_time = service_data.loc[peak_tps_idx, 'group']
-        avg_tps = service_data['tps'].mean()
-        stat_row.update({
-            "Peak TPS": peak_tps,  # Store as number
-            "Peak TPS (Display)": f"{peak_tps:.1f}",  # For display only
-            "Peak TPS Time": peak_tps_time.strftime('%Y-%m-%d %H:00'),
-            "Avg TPS": avg_tps,  # Store as number
-            "Avg TPS (Display)": f"{avg_tps:.1f}",  # For display only
-        })
-    
-    if "Pods" in show_metrics:
-        peak_pods = service_data['pods'].max()
-        peak_pods_idx = service_data['pods'].idxmax()
-        peak_pods_time = service_data.loc[peak_pods_idx, 'group']
-        avg_pods = service_data['pods'].mean()
-        stat_row.update({
-            "Peak Pods": peak_pods,  # Store as number
-            "Peak Pods (Display)": f"{peak_pods:.0f}",  # For display only
-            "Peak Pods Time": peak_pods_time.strftime('%Y-%m-%d %H:00'),
-            "Avg Pods": avg_pods,  # Store as number
-            "Avg Pods (Display)": f"{avg_pods:.1f}",  # For display only
-        })
-    
-    stats.append(stat_row)
+agg_stats = df_agg.groupby('service', sort=False, observed=True).agg(
+    peak_tps=('tps', 'max'),
+    avg_tps=('tps', 'mean'),
+    peak_pods=('pods', 'max'),
+    avg_pods=('pods', 'mean'),
+    peak_tps_idx=('tps', 'idxmax'),
+    peak_pods_idx=('pods', 'idxmax'),
+)
+# Look up all peak times in one gather; services with no data get NaT
+for metric in ['tps', 'pods']:
+    peak_idx = agg_stats.pop(f'peak_{metric}_idx')
+    agg_stats[f'peak_{metric}_time'] = df_agg['group'].reindex(peak_idx).to_numpy()
+agg_stats = agg_stats.reindex(list(service_frames))
 
-# Create DataFrame and sort by numeric values
-stats_df = pd.DataFrame(stats)
+# Create DataFrame column by column, in selection order; numbers are formatted by st.dataframe
+peak_tps_time = agg_stats['peak_tps_time'].dt.strftime('%Y-%m-%d %H:00')
+peak_pods_time = agg_stats['peak_pods_time'].dt.strftime('%Y-%m-%d %H:00')
+stats_df = pd.DataFrame({
+    "Service": agg_stats.index.to_numpy(),
+    "Peak TPS": agg_stats['peak_tps'].to_numpy(),
+    "Peak TPS Time": peak_tps_time.to_numpy(),
+    "Avg TPS": agg_stats['avg_tps'].to_numpy(),
+    "Peak Pods": agg_stats['peak_pods'].to_numpy(),
+    "Peak Pods Time": peak_pods_time.to_numpy(),
+    "Avg Pods": agg_stats['avg_pods'].to_numpy(),
+})
 
-# Create display DataFrame with formatted strings
+# Select the columns for the metrics shown
 display_cols = ["Service"]
 if "TPS" in show_metrics:
-    display_cols.extend(["Peak TPS (Display)", "Peak TPS Time", "Avg TPS (Display)"])
+    display_cols.extend(TPS_STAT_COLS)
 if "Pods" in show_metrics:
-    display_cols.extend(["Peak Pods (Display)", "Peak Pods Time", "Avg Pods (Display)"])
+    display_cols.extend(POD_STAT_COLS)
 
-# Show statistics table with proper column names
-if stats:
+# Show statistics table, letting Streamlit format the numbers
+if not stats_df.empty:
     st.header("Service Statistics")
-    display_df = stats_df[display_cols].copy()
-    # Rename columns to remove "(Display)" suffix
-    display_df.columns = [col.replace(" (Display)", "") for col in display_df.columns]
     st.dataframe(
-        display_df,
+        stats_df[display_cols],
         use_container_width=True,
         column_config={
             "Peak TPS": st.column_config.NumberColumn(format="%.1f"),
@@ -225,28 +317,39 @@ if stats:
         }
     )
 
-# Create correlation plots if both metrics are selected and only one service
-if "TPS" in show_metrics and "Pods" in show_metrics and len(selected_services) == 1:
-    st.header("TPS vs Pods Correlation")
-    
-    service = selected_services[0]
-    service_data = df_agg[df_agg['service'] == service]
-    
+# Build the correlation plot and coefficient once per aggregation, service and trend line
+@st.cache_resource(max_entries=CACHE_MAX_ENTRIES)
+def build_correlation(agg_key, service, trendline, _service_data):
+    service_data = _service_data
+    start_date, end_date = agg_key[1], agg_key[2]
+
     fig_corr = px.scatter(
         service_data,
         x='tps',
         y='pods',
         title=f"{service}: Pod Count vs TPS ({start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')})",
         labels={'tps': 'Transactions Per Second', 'pods': 'Number of Pods'},
-        trendline="lowess",  # Add a trend line
+        trendline=trendline,  # Add a trend line
         trendline_color_override="red"
     )
-    
     fig_corr.update_layout(height=400)
-    st.plotly_chart(fig_corr, use_container_width=True)
-    
+
     # Calculate correlation coefficient
     correlation = service_data['tps'].corr(service_data['pods'])
-    st.markdown(f"Correlation coefficient: **{correlation:.3f}**")
+    return fig_corr, correlation
+
+# Create correlation plots if both metrics are selected and only one service
+if "TPS" in show_metrics and "Pods" in show_metrics and len(selected_services) == 1:
+    st.header("TPS vs Pods Correlation")
+    
+    service = selected_services[0]
+    with st.expander("Show correlation plot"):
+        # LOWESS is much slower than a linear fit, so it is opt-in
+        use_lowess = st.checkbox("Use LOWESS trend line")
+        fig_corr, correlation = build_correlation(
+            agg_key, service, "lowess" if use_lowess else "ols", service_frames[service]
+        )
+        st.plotly_chart(fig_corr, use_container_width=True)
+        st.markdown(f"Correlation coefficient: **{correlation:.3f}**")
 elif "TPS" in show_metrics and "Pods" in show_metrics and len(selected_services) > 1:
     st.info("Select a single service to view its TPS vs Pods correlation analysis.")
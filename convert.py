@@ -0,0 +1,17 @@
+import pandas as pd
+
+# One-off conversion of the hourly CSV export into the Parquet file loaded by app.py.
+# Re-run this whenever ramadan_hourly.csv changes.
+CSV_PATH = 'ramadan_hourly.csv'
+PARQUET_PATH = 'ramadan_hourly.parquet'
+
+df = pd.read_csv(CSV_PATH, dtype={'tps': 'float32', 'pods': 'float32', 'service': 'category'})
+df['hour'] = pd.to_datetime(df['hour'], format='%Y-%m-%d %H:%M:%S')
+
+# The app uses hourly rows as-is for the Hour window, so each service can have only one row per hour
+if df.duplicated(['hour', 'service']).any():
+    raise ValueError(f"{CSV_PATH} has more than one row for some service and hour")
+
+# Parquet keeps the datetime, float32 and categorical dtypes, so the app can load it without parsing
+df.to_parquet(PARQUET_PATH, compression='zstd', index=False)
+print(f"Wrote {len(df)} rows to {PARQUET_PATH}")